@@ -1,8 +1,46 @@
-import json
+import atexit
+import hashlib
+import string
 import sys
+import threading
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+TOP_K_CHUNKS = 3
+# Chunks per /api/embed call, so large documents don't hit the request timeout
+EMBED_BATCH_SIZE = 64
+# Vector count at which VectorStore switches from a NumPy scan to FAISS HNSW
+HNSW_THRESHOLD = 10000
+QUIT_COMMANDS = frozenset({'quit', 'exit', 'q'})
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Split text into overlapping fixed-size chunks"""
+    step = chunk_size - chunk_overlap
+    return [text[start:start + chunk_size] for start in range(0, len(text), step)]
+
+
+class OllamaError(Exception):
+    """Error reported by Ollama inside an otherwise successful streamed response"""
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale vectors to unit length so cosine similarity becomes a plain dot product"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / (norms + 1e-12)
 
 
 class PromptLibrary:
@@ -11,6 +49,7 @@ class PromptLibrary:
     def __init__(self, config_path: str = "prompts.json"):
         self.config_path = config_path
         self.prompts = self._load_prompts()
+        self._compiled: Dict[str, Callable[[str, str], str]] = {}
     
     def _load_prompts(self) -> Dict[str, str]:
         """Load prompt templates from config file"""
@@ -43,8 +82,8 @@ Explanation:"""
         
         try:
             if Path(self.config_path).exists():
-                with open(self.config_path, 'r') as f:
-                    loaded_prompts = json.load(f)
+                with open(self.config_path, 'rb') as f:
+                    loaded_prompts = orjson.loads(f.read())
                     default_prompts.update(loaded_prompts)
         except Exception as e:
             print(f"Warning: Could not load prompts config: {e}")
@@ -55,50 +94,348 @@ Explanation:"""
         """Get a prompt template by type"""
         return self.prompts.get(prompt_type, self.prompts["qa"])
     
+    def render(self, prompt_type: str, document: str, question: str) -> str:
+        """Fill a prompt template by type, like get_prompt(...).format(...)"""
+        # Keyed by template text so edits to self.prompts are never rendered stale
+        template = self.get_prompt(prompt_type)
+        render = self._compiled.get(template)
+        if render is None:
+            render = self._compiled[template] = self._compile(template)
+        return render(document, question)
+    
+    @staticmethod
+    def _compile(template: str) -> Callable[[str, str], str]:
+        """Pre-split a template so rendering is a single join instead of re-parsing it"""
+        def fallback(document: str, question: str) -> str:
+            return template.format(document=document, question=question)
+        
+        try:
+            parsed = list(string.Formatter().parse(template))
+        except ValueError:
+            # Malformed templates keep failing at render time, as with str.format
+            return fallback
+        
+        segments = []
+        fields = []
+        for literal, field, spec, conversion in parsed:
+            segments.append(literal)
+            if field is None:
+                continue
+            if field not in ("document", "question") or spec or conversion:
+                return fallback
+            fields.append((len(segments), field == "document"))
+            segments.append("")
+        
+        def render(document: str, question: str) -> str:
+            parts = segments.copy()
+            for index, is_document in fields:
+                parts[index] = document if is_document else question
+            return "".join(parts)
+        
+        return render
+    
     def save_prompts(self):
         """Save current prompts to config file"""
-        with open(self.config_path, 'w') as f:
-            json.dump(self.prompts, f, indent=2)
+        with open(self.config_path, 'wb') as f:
+            f.write(orjson.dumps(self.prompts, option=orjson.OPT_INDENT_2))
+
+
+def _emit(text: str, on_token: Optional[Callable[[str], None]]) -> str:
+    """Pass a complete answer to on_token, if any, and return it"""
+    if on_token:
+        on_token(text)
+    return text
+
+
+def _print_token(token: str):
+    """Write a streamed token to the terminal immediately"""
+    sys.stdout.write(token)
+    sys.stdout.flush()
+
+
+class VectorStore:
+    """Unit-length vectors searched by inner product (cosine similarity).
+    
+    Searches scan a NumPy matrix until the store reaches HNSW_THRESHOLD
+    vectors; from then on, if faiss is installed, they go through an HNSW index.
+    """
+    
+    def __init__(self):
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.size = 0
+        self.index = None
+        # FAISS HNSW inserts are not thread-safe
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def add(self, vectors: np.ndarray):
+        """Append unit-length rows; their ids continue from the current size"""
+        vectors = np.ascontiguousarray(vectors.reshape(-1, vectors.shape[-1]), dtype=np.float32)
+        with self._lock:
+            if self.size + len(vectors) > len(self.vectors):
+                # Grow by doubling so appends stay amortized O(d)
+                capacity = max(16, 2 * self.size, self.size + len(vectors))
+                grown = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+                if self.size:
+                    grown[:self.size] = self.vectors[:self.size]
+                self.vectors = grown
+            self.vectors[self.size:self.size + len(vectors)] = vectors
+            self.size += len(vectors)
+            if self.index is not None:
+                self.index.add(vectors)
+            elif faiss is not None and self.size >= HNSW_THRESHOLD:
+                self.index = faiss.IndexHNSWFlat(vectors.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+                self.index.hnsw.efConstruction = 200
+                self.index.add(self.vectors[:self.size])
+    
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the scores and ids of the k most similar vectors, best first"""
+        with self._lock:
+            k = min(k, self.size)
+            if k == 0:
+                return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+            if self.index is not None:
+                scores, ids = self.index.search(query.reshape(1, -1), k)
+                found = ids[0] >= 0
+                return scores[0][found], ids[0][found]
+            sims = self.vectors[:self.size] @ query
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            return sims[top], top
+
+
+class SemanticCache:
+    """Answer cache matched by exact key or by question embedding similarity.
+    
+    Embeddings passed in must already be unit length (see normalize_rows).
+    """
+    
+    def __init__(self, cache_path: str = "cache.npz", thresholds: Optional[Dict[str, float]] = None,
+                 default_threshold: float = 0.92):
+        self.cache_path = cache_path
+        # Summary/explain answers tolerate less fuzziness than plain Q&A
+        self.thresholds = {"qa": 0.92, "summary": 0.97, "explain": 0.95}
+        self.thresholds.update(thresholds or {})
+        self.default_threshold = default_threshold
+        # Each answer is stored once; exact keys and scope rows index into this list
+        self.answers: List[str] = []
+        self.exact: Dict[str, int] = {}
+        # Per scope, a vector store of question embeddings and the matching answer indices
+        self.stores: Dict[str, VectorStore] = {}
+        self.answer_ids: Dict[str, List[int]] = {}
+        self._load()
+    
+    @staticmethod
+    def hash_key(text: str) -> str:
+        """Hash arbitrary text into a fixed-size cache key"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    def get_exact(self, key: str) -> Optional[str]:
+        """Return the cached answer stored under an identical key"""
+        index = self.exact.get(self.hash_key(key))
+        return None if index is None else self.answers[index]
+    
+    def get_similar(self, embedding: np.ndarray, scope: str, prompt_type: str) -> Optional[str]:
+        """Return the answer of the most similar cached question within the same scope"""
+        store = self.stores.get(scope)
+        if store is None:
+            return None
+        scores, ids = store.search(embedding, 1)
+        if len(ids) and scores[0] >= self.thresholds.get(prompt_type, self.default_threshold):
+            return self.answers[self.answer_ids[scope][ids[0]]]
+        return None
+    
+    def add(self, key: str, answer: str, embedding: Optional[np.ndarray] = None, scope: str = ""):
+        """Store an answer under its key and, if given, its question embedding"""
+        index = len(self.answers)
+        self.answers.append(answer)
+        self.exact[self.hash_key(key)] = index
+        if embedding is None:
+            return
+        if scope not in self.stores:
+            self.stores[scope] = VectorStore()
+            self.answer_ids[scope] = []
+        self.stores[scope].add(embedding)
+        self.answer_ids[scope].append(index)
+    
+    @property
+    def _index_path(self) -> Path:
+        """JSON file holding the answer text and indices next to the embedding arrays"""
+        return Path(self.cache_path).with_suffix(".json")
+    
+    def _load(self):
+        """Load a previously saved cache, if any"""
+        try:
+            if self._index_path.exists() and Path(self.cache_path).exists():
+                with open(self._index_path, 'rb') as f:
+                    index = orjson.loads(f.read())
+                with np.load(self.cache_path) as data:
+                    for i, (scope, ids) in enumerate(index["scopes"]):
+                        self.stores[scope] = VectorStore()
+                        self.stores[scope].add(data[f"embeddings_{i}"])
+                        self.answer_ids[scope] = ids
+                self.answers = index["answers"]
+                self.exact = index["exact"]
+        except Exception as e:
+            print(f"Warning: Could not load answer cache: {e}")
+    
+    def save(self):
+        """Save the cache to disk"""
+        # One embedding matrix per scope, since widths differ between embedding models;
+        # answer text goes in JSON so it isn't padded to a fixed width
+        scopes = list(self.stores)
+        np.savez(
+            self.cache_path,
+            **{f"embeddings_{i}": self.stores[scope].vectors[:len(self.stores[scope])]
+               for i, scope in enumerate(scopes)}
+        )
+        index = {
+            "answers": self.answers,
+            "exact": self.exact,
+            "scopes": [[scope, self.answer_ids[scope]] for scope in scopes]
+        }
+        with open(self._index_path, 'wb') as f:
+            f.write(orjson.dumps(index))
 
 
 class OllamaQA:
     """Q&A system using Ollama local LLM"""
     
-    def __init__(self, model: str = "llama3", host: str = "http://localhost:11434"):
+    def __init__(self, model: str = "llama3", host: str = "http://localhost:11434",
+                 embed_model: str = "nomic-embed-text"):
         self.model = model
         self.host = host
+        self.embed_model = embed_model
         self.prompt_lib = PromptLibrary()
+        # One pooled keep-alive session for every call to Ollama
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.session.headers["Connection"] = "keep-alive"
+        self.session.headers["Content-Type"] = "application/json"
+        self.cache = SemanticCache()
+        atexit.register(self.cache.save)
+        # Chunk index of the most recently loaded document
+        self.indexed_doc_key: Optional[str] = None
+        self.chunks: List[str] = []
+        self.chunk_index = VectorStore()
     
-    def _call_ollama(self, prompt: str) -> str:
-        """Make API call to Ollama"""
-        try:
-            response = requests.post(
-                f"{self.host}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "stream": False
-                },
-                timeout=60
-            )
+    def _call_ollama(self, prompt: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Make API call to Ollama, passing each generated token to on_token as it arrives"""
+        parts = []
+        with self.session.post(
+            f"{self.host}/api/generate",
+            data=orjson.dumps({
+                "model": self.model,
+                "prompt": prompt,
+                "stream": True
+            }),
+            stream=True,
+            timeout=60
+        ) as response:
             response.raise_for_status()
-            return response.json()["response"]
-        except requests.exceptions.RequestException as e:
-            return f"Error calling Ollama: {e}"
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                if "error" in chunk:
+                    # Errors mid-generation arrive as an NDJSON line on a 200 response
+                    raise OllamaError(chunk["error"])
+                token = chunk.get("response", "")
+                parts.append(token)
+                if on_token:
+                    on_token(token)
+        return "".join(parts)
+    
+    def _embed_batch(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Embed texts as unit-length rows, EMBED_BATCH_SIZE per Ollama call, or None if the embedding model is unavailable"""
+        batches = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            try:
+                response = self.session.post(
+                    f"{self.host}/api/embed",
+                    data=orjson.dumps({"model": self.embed_model, "input": texts[start:start + EMBED_BATCH_SIZE]}),
+                    timeout=60
+                )
+                response.raise_for_status()
+                batches.append(normalize_rows(orjson.loads(response.content)["embeddings"]))
+            except (requests.exceptions.RequestException, orjson.JSONDecodeError, KeyError):
+                return None
+        return np.vstack(batches)
+    
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed a single text, or None if the embedding model is unavailable"""
+        embeddings = self._embed_batch([text])
+        return None if embeddings is None else embeddings[0]
     
     def load_document(self, file_path: str) -> str:
-        """Load document content from file"""
+        """Load document content from file and index its chunks for retrieval"""
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+                document = f.read()
         except Exception as e:
             raise Exception(f"Error loading document: {e}")
+        self._index_document(document)
+        return document
     
-    def ask_question(self, document: str, question: str, prompt_type: str = "qa") -> str:
-        """Ask a question about the document"""
+    def _index_document(self, document: str):
+        """Embed the document's chunks so questions only need the most relevant ones"""
+        self.indexed_doc_key = None
+        self.chunk_index = VectorStore()
+        self.chunks = chunk_text(document)
+        if len(self.chunks) <= TOP_K_CHUNKS:
+            return
+        embeddings = self._embed_batch(self.chunks)
+        if embeddings is None:
+            print("Warning: Could not embed document chunks, questions will use the full document")
+            return
+        self.chunk_index.add(embeddings)
+        self.indexed_doc_key = SemanticCache.hash_key(document)
+    
+    def _select_context(self, document: str, doc_key: str, question_embedding: Optional[np.ndarray]) -> str:
+        """Return the chunks most similar to the question, or the whole document if it is not indexed"""
+        if question_embedding is None or doc_key != self.indexed_doc_key:
+            return document
+        _, top_k = self.chunk_index.search(question_embedding, TOP_K_CHUNKS)
+        # Keep the selected chunks in document order
+        return "\n\n".join(self.chunks[i] for i in sorted(top_k))
+    
+    def ask_question(self, document: str, question: str, prompt_type: str = "qa",
+                     on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Ask a question about the document.
+        
+        If on_token is given, the answer is also passed to it as it is generated;
+        cached answers and errors are passed in one piece.
+        """
         prompt_template = self.prompt_lib.get_prompt(prompt_type)
-        prompt = prompt_template.format(document=document, question=question)
-        return self._call_ollama(prompt)
+        doc_key = SemanticCache.hash_key(document)
+        # Answers depend on the generating model; embeddings of different models can't be compared
+        scope = f"{self.model}:{self.embed_model}:{prompt_type}:{SemanticCache.hash_key(prompt_template)}:{doc_key}"
+        
+        cached = self.cache.get_exact(f"{scope}:{question}")
+        if cached is not None:
+            return _emit(cached, on_token)
+        
+        embedding = self._embed(question)
+        if embedding is not None:
+            cached = self.cache.get_similar(embedding, scope, prompt_type)
+            if cached is not None:
+                return _emit(cached, on_token)
+        
+        # Templates that don't take a question (e.g. summary) need the whole document
+        if "{question}" in prompt_template:
+            context = self._select_context(document, doc_key, embedding)
+        else:
+            context = document
+        prompt = self.prompt_lib.render(prompt_type, document=context, question=question)
+        
+        try:
+            answer = self._call_ollama(prompt, on_token)
+        except (requests.exceptions.RequestException, OllamaError) as e:
+            return _emit(f"Error calling Ollama: {e}", on_token)
+        self.cache.add(f"{scope}:{question}", answer, embedding, scope)
+        return answer
     
     def interactive_session(self, file_path: str):
         """Start interactive Q&A session"""
@@ -108,15 +445,19 @@ class OllamaQA:
             print(f"✓ Using model: {self.model}")
             print("✓ Ready for questions! (type 'quit' to exit, 'help' for commands)\n")
             
+            prompt_type = "qa"
+            commands = {'help': self._show_help}
+            
             while True:
                 question = input("❓ Your question: ").strip()
+                q_lower = question.lower()
                 
-                if question.lower() in ['quit', 'exit', 'q']:
+                if q_lower in QUIT_COMMANDS:
                     break
-                elif question.lower() == 'help':
-                    self._show_help()
+                elif q_lower in commands:
+                    commands[q_lower]()
                     continue
-                elif question.lower().startswith('mode:'):
+                elif q_lower.startswith('mode:'):
                     mode = question.split(':', 1)[1].strip()
                     if mode in self.prompt_lib.prompts:
                         print(f"✓ Switched to mode: {mode}")
@@ -129,8 +470,9 @@ class OllamaQA:
                 
                 print("🤔 Thinking...")
                 try:
-                    answer = self.ask_question(document, question, prompt_type)
-                    print(f"\n💡 Answer:\n{answer}\n")
+                    print("\n💡 Answer:")
+                    self.ask_question(document, question, prompt_type, on_token=_print_token)
+                    print("\n")
                 except Exception as e:
                     print(f"❌ Error: {e}\n")
         
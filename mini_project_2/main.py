@@ -1,90 +1,435 @@
+import array
+import asyncio
+import hashlib
 import os
 import logging
-from typing import List
+import sqlite3
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple, Union
 from chromadb import PersistentClient
-from ollama import Client as OllamaClient
+from chromadb.config import Settings
+from ollama import AsyncClient as AsyncOllamaClient, Client as OllamaClient
 from pathlib import Path
 
+try:
+    import sqlite_vec
+except ImportError:
+    sqlite_vec = None
+
+# Prefer PDFium for PDFs, falling back to PyPDF2 when it isn't installed
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    from PyPDF2 import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    from docx import Document
+except ImportError:
+    Document = None
+
+try:
+    import faiss
+    import numpy as np
+except ImportError:
+    faiss = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DOCUMENTS_DIR = os.path.join(SCRIPT_DIR, "team_docs")
 CHROMA_PERSIST_DIR = os.path.join(SCRIPT_DIR, "chroma_db")
+EMBEDDING_CACHE_PATH = os.path.join(SCRIPT_DIR, "embedding_cache.sqlite")
+VECTOR_DB_PATH = os.path.join(SCRIPT_DIR, "knowledge_base.sqlite")
+# "sqlite-vec" (default), "chroma", or "faiss" (in-memory, rebuilt from the embedding cache on start)
+VECTOR_BACKEND = os.environ.get("KB_VECTOR_BACKEND", "sqlite-vec")
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
+OLLAMA_HOST = "http://localhost:11434"
+EMBED_MODEL = "nomic-embed-text"
+EMBEDDING_DIM = 768
+EMBED_CONCURRENCY = 16
+ADD_BATCH_SIZE = 512
+
+_PDFIUM_LOCK = threading.Lock()
+
+class EmbeddingCache:
+    """SQLite store of embeddings keyed by the SHA-256 of the embedded text.
+
+    Also records the (mtime, size) of every file ingested into the vector
+    store named by scope, so unchanged files can be skipped on the next start.
+    """
+
+    def __init__(self, path: str, scope: str):
+        self.scope = scope
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS emb (hash TEXT PRIMARY KEY, vec BLOB)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files "
+            "(scope TEXT, path TEXT, mtime REAL, size INTEGER, PRIMARY KEY (scope, path))"
+        )
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        row = self.conn.execute("SELECT vec FROM emb WHERE hash = ?", (self.key(text),)).fetchone()
+        if row is None:
+            return None
+        return array.array("f", row[0]).tolist()
+
+    def put(self, text: str, embedding: List[float]):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO emb (hash, vec) VALUES (?, ?)",
+            (self.key(text), array.array("f", embedding).tobytes())
+        )
+
+    def is_current(self, file_path: str) -> bool:
+        stat = os.stat(file_path)
+        row = self.conn.execute(
+            "SELECT mtime, size FROM files WHERE scope = ? AND path = ?", (self.scope, file_path)
+        ).fetchone()
+        return row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size
+
+    def tracked_files(self) -> Set[str]:
+        return {row[0] for row in self.conn.execute("SELECT path FROM files WHERE scope = ?", (self.scope,))}
+
+    def record_file(self, file_path: str):
+        stat = os.stat(file_path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (scope, path, mtime, size) VALUES (?, ?, ?, ?)",
+            (self.scope, file_path, stat.st_mtime, stat.st_size)
+        )
+
+    def forget_file(self, file_path: str):
+        self.conn.execute("DELETE FROM files WHERE scope = ? AND path = ?", (self.scope, file_path))
+
+    def forget_files(self):
+        self.conn.execute("DELETE FROM files WHERE scope = ?", (self.scope,))
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+class SqliteVecStore:
+    """Chunk store searched through a sqlite-vec vec0 table.
+
+    Chunk text lives in a plain chunks table whose id is the rowid of the
+    chunk's embedding in vec_chunks.
+    """
+
+    name = "sqlite-vec"
+    persistent = True
+
+    def __init__(self, path: str, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.conn = sqlite3.connect(path)
+        self.conn.enable_load_extension(True)
+        sqlite_vec.load(self.conn)
+        self.conn.enable_load_extension(False)
+        self._create_tables()
+
+    def _create_tables(self):
+        self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, source TEXT, text TEXT)")
+        self.conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS vec_chunks USING vec0(embedding FLOAT[{self.dim}])")
+        self.conn.commit()
+
+    def _pack(self, embedding: List[float]) -> bytes:
+        return struct.pack(f"{self.dim}f", *embedding)
+
+    def reset(self):
+        self.conn.execute("DROP TABLE IF EXISTS vec_chunks")
+        self.conn.execute("DROP TABLE IF EXISTS chunks")
+        self._create_tables()
+
+    def delete_source(self, source: str):
+        with self.conn:
+            self.conn.execute("DELETE FROM vec_chunks WHERE rowid IN (SELECT id FROM chunks WHERE source = ?)", (source,))
+            self.conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+
+    def add(self, batch: List[Tuple[str, int, str, List[float]]]):
+        with self.conn:
+            for source, _, chunk, embedding in batch:
+                cursor = self.conn.execute("INSERT INTO chunks (source, text) VALUES (?, ?)", (source, chunk))
+                self.conn.execute(
+                    "INSERT INTO vec_chunks (rowid, embedding) VALUES (?, ?)",
+                    (cursor.lastrowid, self._pack(embedding))
+                )
+
+    def query(self, embedding: List[float], n_results: int) -> List[str]:
+        rows = self.conn.execute(
+            "SELECT chunks.text FROM "
+            "(SELECT rowid, distance FROM vec_chunks WHERE embedding MATCH ? AND k = ?) AS knn "
+            "JOIN chunks ON chunks.id = knn.rowid ORDER BY knn.distance",
+            (self._pack(embedding), n_results)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+class ChromaStore:
+    """Chunk store backed by a persistent Chroma collection"""
+
+    name = "chroma"
+    persistent = True
+
+    def __init__(self, persist_dir: str, collection_name: str = "team_docs"):
+        self.client = PersistentClient(path=persist_dir, settings=Settings(anonymized_telemetry=False))
+        self.collection_name = collection_name
+        self.collection = self.client.get_or_create_collection(name=collection_name)
+
+    def reset(self):
+        try:
+            self.client.delete_collection(name=self.collection_name)
+        except:
+            pass
+        self.collection = self.client.get_or_create_collection(name=self.collection_name)
+
+    def delete_source(self, source: str):
+        self.collection.delete(where={"source": source})
+
+    def add(self, batch: List[Tuple[str, int, str, List[float]]]):
+        # Upsert keeps re-ingesting a file idempotent even if its old chunks linger
+        self.collection.upsert(
+            documents=[chunk for _, _, chunk, _ in batch],
+            embeddings=[embedding for _, _, _, embedding in batch],
+            metadatas=[{"source": source} for source, _, _, _ in batch],
+            ids=[f"{source}:{i}" for source, i, _, _ in batch]
+        )
+
+    def query(self, embedding: List[float], n_results: int) -> List[str]:
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=n_results,
+            include=["documents"]
+        )
+        return results['documents'][0]
+
+    def close(self):
+        pass
+
+class FaissStore:
+    """In-memory chunk store searched through a FAISS HNSW index.
 
-def load_documents(doc_dir: str) -> List[str]:
-    documents = []
+    Nothing is persisted; main() re-ingests every start, which only costs
+    SQLite lookups because the embeddings come from the embedding cache.
+    """
+
+    name = "faiss"
+    persistent = False
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        # FAISS HNSW inserts are not thread-safe
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.index = faiss.IndexHNSWFlat(self.dim, 32)
+            self.index.hnsw.efConstruction = 200
+            # Row i of the index; None once its source has been deleted
+            self.chunks: List[Optional[Tuple[str, str]]] = []
+            self.deleted = 0
+
+    def delete_source(self, source: str):
+        # HNSW cannot remove vectors, so deleted rows are skipped at query time
+        with self._lock:
+            for i, chunk in enumerate(self.chunks):
+                if chunk is not None and chunk[0] == source:
+                    self.chunks[i] = None
+                    self.deleted += 1
+
+    def add(self, batch: List[Tuple[str, int, str, List[float]]]):
+        vectors = np.array([embedding for _, _, _, embedding in batch], dtype=np.float32)
+        with self._lock:
+            self.index.add(vectors)
+            self.chunks.extend((source, chunk) for source, _, chunk, _ in batch)
+
+    def query(self, embedding: List[float], n_results: int) -> List[str]:
+        query = np.array([embedding], dtype=np.float32)
+        with self._lock:
+            _, ids = self.index.search(query, n_results + self.deleted)
+            texts = [self.chunks[i][1] for i in ids[0] if i >= 0 and self.chunks[i] is not None]
+        return texts[:n_results]
+
+    def close(self):
+        pass
+
+def open_store(backend: str = VECTOR_BACKEND):
+    if backend == "sqlite-vec":
+        if sqlite_vec is None:
+            logger.warning("sqlite-vec is not installed, falling back to Chroma")
+        else:
+            try:
+                return SqliteVecStore(VECTOR_DB_PATH)
+            except (AttributeError, sqlite3.OperationalError) as e:
+                # Python builds without loadable-extension support can't use sqlite-vec
+                logger.warning(f"Could not load sqlite-vec ({e}), falling back to Chroma")
+    elif backend == "faiss":
+        if faiss is not None:
+            return FaissStore()
+        logger.warning("faiss is not installed, falling back to Chroma")
+    return ChromaStore(CHROMA_PERSIST_DIR)
+
+def list_documents(doc_dir: str) -> List[str]:
+    file_paths = []
     for root, _, files in os.walk(doc_dir):
         for file in files:
-            file_path = os.path.join(root, file)
+            file_paths.append(os.path.join(root, file))
+    return file_paths
+
+def _load_txt(file_path: str) -> str:
+    return Path(file_path).read_text(encoding="utf-8")
+
+def _load_pdf(file_path: str) -> str:
+    if pdfium is not None:
+        # PDFium is not thread-safe, so PDFs are parsed one at a time
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(file_path)
             try:
-                if file.lower().endswith(".txt"):
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        documents.append(f.read())
-                elif file.lower().endswith(".pdf"):
-                    from PyPDF2 import PdfReader
-                    reader = PdfReader(file_path)
-                    text = ""
-                    for page in reader.pages:
-                        text += page.extract_text() or ""
-                    documents.append(text)
-                elif file.lower().endswith(".docx"):
-                    from docx import Document
-                    doc = Document(file_path)
-                    text = "\n".join([p.text for p in doc.paragraphs])
-                    documents.append(text)
-                else:
-                    logger.warning(f"Unsupported file type: {file_path}")
-            except Exception as e:
-                logger.error(f"Failed to load {file_path}: {e}")
-    logger.info(f"Loaded {len(documents)} documents from {doc_dir}")
+                return "".join(page.get_textpage().get_text_range() for page in pdf)
+            finally:
+                pdf.close()
+    if PdfReader is not None:
+        reader = PdfReader(file_path)
+        return "".join(page.extract_text() or "" for page in reader.pages)
+    raise ImportError("pypdfium2 or PyPDF2 is required to load PDF files")
+
+def _load_docx(file_path: str) -> str:
+    if Document is None:
+        raise ImportError("python-docx is required to load DOCX files")
+    doc = Document(file_path)
+    return "\n".join([p.text for p in doc.paragraphs])
+
+_LOADERS = {
+    ".txt": _load_txt,
+    ".pdf": _load_pdf,
+    ".docx": _load_docx,
+}
+
+def _load_one(file_path: str) -> Optional[str]:
+    loader = _LOADERS.get(os.path.splitext(file_path)[1].lower())
+    if loader is None:
+        logger.warning(f"Unsupported file type: {file_path}")
+        return None
+    try:
+        return loader(file_path)
+    except Exception as e:
+        logger.error(f"Failed to load {file_path}: {e}")
+        return None
+
+def load_documents(file_paths: List[str]) -> Dict[str, str]:
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        texts = executor.map(_load_one, file_paths)
+        documents = {path: text for path, text in zip(file_paths, texts) if text is not None}
+    logger.info(f"Loaded {len(documents)} documents")
     return documents
 
-def chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
-    chunks = []
-    start = 0
-    text_length = len(text)
-    while start < text_length:
-        end = min(start + chunk_size, text_length)
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start += chunk_size - chunk_overlap
-    return chunks
+def chunk_text(text: Union[str, bytes], chunk_size: int, chunk_overlap: int) -> List[str]:
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", errors="replace")
+    step = chunk_size - chunk_overlap
+    return [text[start:start + chunk_size] for start in range(0, len(text), step)]
 
 def embed_text(text: str, ollama_client) -> List[float]:
-    response = ollama_client.embeddings(model='nomic-embed-text', prompt=text)
+    response = ollama_client.embeddings(model=EMBED_MODEL, prompt=text)
     return response['embedding']
 
-def main():
-    ollama_client = OllamaClient(host='http://localhost:11434')
+async def embed_chunks(chunks: List[str], cache: EmbeddingCache, host: str = OLLAMA_HOST) -> List[Optional[List[float]]]:
+    """Embed chunks concurrently, at most EMBED_CONCURRENCY requests in flight.
 
-    chroma_client = PersistentClient(path=CHROMA_PERSIST_DIR)
+    Returns one embedding per chunk, or None where embedding failed.
+    """
+    client = AsyncOllamaClient(host=host)
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
 
-    try:
-        chroma_client.delete_collection(name="team_docs")
-    except:
-        pass
+    async def embed_one(chunk: str) -> Optional[List[float]]:
+        cached = cache.get(chunk)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            try:
+                response = await client.embeddings(model=EMBED_MODEL, prompt=chunk)
+            except Exception as e:
+                logger.error(f"Failed to embed chunk: {e}")
+                return None
+        cache.put(chunk, response['embedding'])
+        return response['embedding']
 
-    collection = chroma_client.create_collection(name="team_docs")
+    return await asyncio.gather(*(embed_one(chunk) for chunk in chunks))
 
-    documents = load_documents(DOCUMENTS_DIR)
+def ingest_documents(store, cache: EmbeddingCache, doc_dir: str):
+    """Bring the collection in line with doc_dir, re-embedding only changed files"""
+    file_paths = list_documents(doc_dir)
+    changed = [path for path in file_paths if not cache.is_current(path)]
+    removed = cache.tracked_files() - set(file_paths)
 
-    doc_id = 0
-    for doc in documents:
-        chunks = chunk_text(doc, CHUNK_SIZE, CHUNK_OVERLAP)
-        for chunk in chunks:
-            try:
-                embedding = embed_text(chunk, ollama_client)
-                collection.add(
-                    documents=[chunk],
-                    embeddings=[embedding],
-                    ids=[str(doc_id)]
-                )
-                doc_id += 1
-            except Exception as e:
-                logger.error(f"Failed to add chunk to collection: {e}")
+    for path in changed + sorted(removed):
+        store.delete_source(path)
+    for path in removed:
+        cache.forget_file(path)
+
+    logger.info(f"{len(file_paths) - len(changed)} documents unchanged, {len(changed)} to ingest")
+    documents = load_documents(changed)
+
+    entries = [
+        (path, i, chunk)
+        for path, text in documents.items()
+        for i, chunk in enumerate(chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP))
+    ]
+    embeddings = asyncio.run(embed_chunks([chunk for _, _, chunk in entries], cache))
+
+    failed = set()
+    embedded = []
+    for (path, i, chunk), embedding in zip(entries, embeddings):
+        if embedding is None:
+            failed.add(path)
+        else:
+            embedded.append((path, i, chunk, embedding))
+
+    for start in range(0, len(embedded), ADD_BATCH_SIZE):
+        batch = embedded[start:start + ADD_BATCH_SIZE]
+        try:
+            store.add(batch)
+        except Exception as e:
+            logger.error(f"Failed to add chunks to {store.name} store: {e}")
+            failed.update(path for path, _, _, _ in batch)
+
+    # Files with missing chunks stay unrecorded so the next start retries them
+    for path in documents:
+        if path not in failed:
+            cache.record_file(path)
+    cache.commit()
+
+def main():
+    ollama_client = OllamaClient(host=OLLAMA_HOST)
+
+    store = open_store()
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH, scope=store.name)
+
+    if not store.persistent:
+        # The store starts empty, so every file has to be ingested again
+        cache.forget_files()
+
+    if not cache.tracked_files():
+        # Nothing recorded yet, so any existing chunks predate the file manifest
+        store.reset()
+
+    ingest_documents(store, cache, DOCUMENTS_DIR)
 
     logger.info("Document ingestion and embedding storage complete.")
 
@@ -96,22 +441,22 @@ def main():
         try:
             query_embedding = embed_text(query, ollama_client)
 
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=3,
-                include=["documents"]
-            )
-            context_chunks = results['documents'][0]
+            context_chunks = store.query(query_embedding, n_results=3)
 
             messages = [
                 {"role": "system", "content": "You are a helpful assistant. Use the provided context to answer the question."},
                 {"role": "user", "content": "\n\n".join(context_chunks) + f"\n\nQuestion: {query}"}
             ]
 
-            response = ollama_client.chat(model='llama3', messages=messages)
-            print("Answer:", response['message']['content'])
+            print("Answer: ", end="", flush=True)
+            for part in ollama_client.chat(model='llama3', messages=messages, stream=True):
+                print(part['message']['content'], end="", flush=True)
+            print()
         except Exception as e:
             logger.error(f"Error during query processing: {e}")
 
+    cache.close()
+    store.close()
+
 if __name__ == "__main__":
     main()
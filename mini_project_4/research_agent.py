@@ -1,36 +1,183 @@
 import gradio as gr
-import requests
-import json
+import contextlib
+import functools
+import hashlib
+import inspect
 import re
-from typing import List, Dict, Any
+import textwrap
+import time
+from pathlib import Path
+from typing import List, Dict, Any, AsyncIterator, Optional
 from datetime import datetime
 import asyncio
 import aiohttp
+import orjson
 from urllib.parse import quote
 
+OLLAMA_TIMEOUT = aiohttp.ClientTimeout(total=120)
+# Google Custom Search free tier allows 10 queries per second
+CSE_CONCURRENCY = 10
+
+# Prefixes stripped from each line of the LLM's task plan
+TASK_PREFIX_RE = re.compile(r'^Task \d+:\s*')
+NUMBER_PREFIX_RE = re.compile(r'^\d+\.\s*')
+BULLET_PREFIX_RE = re.compile(r'^[-•]\s*')
+
+def disk_cache(path: str, ttl: Optional[float] = None, key_prefix=None):
+    """Cache an async method's result in a JSON file, keyed by the SHA-256 of its argument.
+
+    Entries older than ttl seconds, if given, are recomputed and dropped on
+    the next write. key_prefix, if given, is called with the instance and
+    its result is prepended to the argument before hashing, so results
+    that depend on instance settings are kept apart.
+
+    Async generator methods are cached as the concatenation of the strings
+    they yield, and replay it as a single item on a hit. The wrapped method
+    should raise rather than return a fallback, so that failures are never
+    cached.
+    """
+    def decorator(func):
+        entries = {}
+        try:
+            if Path(path).exists():
+                with open(path, 'rb') as f:
+                    entries = orjson.loads(f.read())
+        except Exception as e:
+            print(f"Warning: Could not load cache {path}: {e}")
+        
+        def lookup(key: str):
+            entry = entries.get(key)
+            if entry is None or (ttl is not None and time.time() - entry["created"] > ttl):
+                return None
+            return entry
+        
+        def make_key(self, text: str) -> str:
+            if key_prefix is not None:
+                text = f"{key_prefix(self)}:{text}"
+            return hashlib.sha256(text.encode("utf-8")).hexdigest()
+        
+        def store(key: str, value):
+            now = time.time()
+            if ttl is not None:
+                for stale in [k for k, e in entries.items() if now - e["created"] > ttl]:
+                    del entries[stale]
+            entries[key] = {"created": now, "value": value}
+            with open(path, 'wb') as f:
+                f.write(orjson.dumps(entries))
+        
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def gen_wrapper(self, text: str):
+                key = make_key(self, text)
+                entry = lookup(key)
+                if entry is not None:
+                    yield entry["value"]
+                    return
+                parts = []
+                async for part in func(self, text):
+                    parts.append(part)
+                    yield part
+                store(key, "".join(parts))
+            
+            return gen_wrapper
+        
+        @functools.wraps(func)
+        async def wrapper(self, text: str):
+            key = make_key(self, text)
+            entry = lookup(key)
+            if entry is not None:
+                return entry["value"]
+            value = await func(self, text)
+            store(key, value)
+            return value
+        
+        return wrapper
+    return decorator
+
 class ResearchAgent:
     def __init__(self, ollama_host="http://localhost:11434", google_api_key=None, google_cx=None):
         self.ollama_host = ollama_host
         self.model = "llama3"
         self.google_api_key = google_api_key
         self.google_cx = google_cx
+        self.session = None
+        self.cse_limiter = None
+        self._active_runs = 0
+    
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        """Create the shared keep-alive session on first use"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, limit_per_host=10, keepalive_timeout=60, ttl_dns_cache=300),
+                json_serialize=lambda obj: orjson.dumps(obj).decode()
+            )
+        if self.cse_limiter is None:
+            # Created inside the running loop; on Python < 3.10 a Semaphore binds to
+            # the loop current at construction, which isn't Gradio's at import time
+            self.cse_limiter = asyncio.Semaphore(CSE_CONCURRENCY)
+        return self.session
+    
+    async def close(self):
+        """Close the shared session"""
+        # Detach first so a run starting during the await gets a fresh session
+        session, self.session = self.session, None
+        if session is not None and not session.closed:
+            await session.close()
+    
+    @contextlib.asynccontextmanager
+    async def active(self):
+        """Keep the shared session open for a run, closing it when the last overlapping run ends.
+        
+        The session lives on Gradio's event loop, which is already gone by the
+        time launch() returns, so it is released whenever the agent goes idle.
+        """
+        self._active_runs += 1
+        try:
+            yield self
+        finally:
+            self._active_runs -= 1
+            if self._active_runs == 0:
+                await self.close()
+        
+    async def check_ollama(self) -> bool:
+        """Check that Ollama is reachable, leaving a warm connection in the pool"""
+        try:
+            session = await self._ensure_session()
+            async with session.get(f"{self.ollama_host}/api/tags",
+                                   timeout=aiohttp.ClientTimeout(total=5)) as response:
+                return response.status == 200
+        except Exception:
+            return False
+        
+    async def stream_ollama(self, prompt: str, system_prompt: str = "") -> AsyncIterator[str]:
+        """Stream response tokens from the Ollama API as they are generated"""
+        session = await self._ensure_session()
+        url = f"{self.ollama_host}/api/generate"
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True
+        }
+        if system_prompt:
+            payload["system"] = system_prompt
+        
+        async with session.post(url, json=payload, timeout=OLLAMA_TIMEOUT) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                chunk = orjson.loads(line)
+                if "error" in chunk:
+                    # Errors mid-generation arrive as an NDJSON line on a 200 response
+                    raise RuntimeError(f"Ollama error: {chunk['error']}")
+                yield chunk.get("response", "")
         
     async def call_ollama(self, prompt: str, system_prompt: str = "") -> str:
         """Call Ollama API"""
         try:
-            url = f"{self.ollama_host}/api/generate"
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "system": system_prompt,
-                "stream": False
-            }
-            
-            response = requests.post(url, json=payload, timeout=120)
-            if response.status_code == 200:
-                return response.json()["response"]
-            else:
-                return f"Error calling Ollama: {response.status_code}"
+            return "".join([token async for token in self.stream_ollama(prompt, system_prompt)])
+        except aiohttp.ClientResponseError as e:
+            return f"Error calling Ollama: {e.status}"
         except Exception as e:
             return f"Error: {str(e)}"
     
@@ -40,38 +187,40 @@ class ResearchAgent:
             return self._fallback_search_results(query)
         
         try:
-            # Google Custom Search API
-            url = "https://www.googleapis.com/customsearch/v1"
-            params = {
-                'key': self.google_api_key,
-                'cx': self.google_cx,
-                'q': query,
-                'num': min(num_results, 10)  # Max 10 per request
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        results = []
-                        
-                        for item in data.get('items', []):
-                            results.append({
-                                "title": item.get('title', 'No title'),
-                                "snippet": item.get('snippet', 'No description available'),
-                                "url": item.get('link', ''),
-                                "source": item.get('displayLink', 'Unknown source')
-                            })
-                        
-                        return results
-                    else:
-                        print(f"Google Search API error: {response.status}")
-                        return self._fallback_search_results(query)
-            
+            results = await self._google_search(query)
+            return results[:num_results]
         except Exception as e:
             print(f"Search error: {str(e)}")
             return self._fallback_search_results(query)
     
+    @disk_cache("searches.json", ttl=24 * 3600, key_prefix=lambda self: self.google_cx)
+    async def _google_search(self, query: str) -> List[Dict[str, str]]:
+        """Fetch the top 10 Google Custom Search results for a query"""
+        url = "https://www.googleapis.com/customsearch/v1"
+        params = {
+            'key': self.google_api_key,
+            'cx': self.google_cx,
+            'q': query,
+            'num': 10  # Max 10 per request; callers slice what they need
+        }
+        
+        session = await self._ensure_session()
+        async with self.cse_limiter, session.get(url, params=params) as response:
+            if response.status != 200:
+                raise RuntimeError(f"Google Search API error: {response.status}")
+            data = orjson.loads(await response.read())
+        
+        results = []
+        for item in data.get('items', []):
+            results.append({
+                "title": item.get('title', 'No title'),
+                "snippet": item.get('snippet', 'No description available'),
+                "url": item.get('link', ''),
+                "source": item.get('displayLink', 'Unknown source')
+            })
+        
+        return results
+    
     def _fallback_search_results(self, query: str) -> List[Dict[str, str]]:
         """Fallback when web search fails - use LLM knowledge"""
         return [
@@ -83,8 +232,17 @@ class ResearchAgent:
             }
         ]
     
-    def plan_research_tasks(self, query: str) -> List[str]:
+    async def plan_research_tasks(self, query: str) -> List[str]:
         """Plan research tasks based on the query"""
+        try:
+            return await self._plan_with_llm(query)
+        except Exception as e:
+            # Fallback tasks
+            return [f"General information about {query}", f"Recent developments in {query}", f"Expert opinions on {query}"]
+    
+    @disk_cache("plans.json")
+    async def _plan_with_llm(self, query: str) -> List[str]:
+        """Ask the LLM to break the query into search tasks"""
         planning_prompt = f"""
 Given this research query: "{query}"
 
@@ -100,35 +258,44 @@ etc.
 Keep tasks focused and searchable.
 """
         
-        try:
-            response = requests.post(f"{self.ollama_host}/api/generate", 
-                                   json={"model": self.model, "prompt": planning_prompt, "stream": False},
-                                   timeout=120)
-            
-            if response.status_code == 200:
-                plan_text = response.json()["response"]
-                # Extract tasks from the response
-                tasks = []
-                for line in plan_text.split('\n'):
-                    if line.strip() and ('Task' in line or line.strip().startswith(('-', '•', '1.', '2.', '3.', '4.', '5.'))):
-                        # Clean up the task text
-                        task = re.sub(r'^Task \d+:\s*', '', line.strip())
-                        task = re.sub(r'^\d+\.\s*', '', task.strip())
-                        task = re.sub(r'^[-•]\s*', '', task.strip())
-                        if task:
-                            tasks.append(task)
-                
-                return tasks[:5]  # Limit to 5 tasks
-            else:
-                # Fallback tasks
-                return [f"General information about {query}", f"Recent developments in {query}", f"Expert opinions on {query}"]
-                
-        except Exception as e:
-            # Fallback tasks
-            return [f"General information about {query}", f"Recent developments in {query}", f"Expert opinions on {query}"]
+        session = await self._ensure_session()
+        async with session.post(f"{self.ollama_host}/api/generate",
+                                json={"model": self.model, "prompt": planning_prompt, "stream": False},
+                                timeout=OLLAMA_TIMEOUT) as response:
+            response.raise_for_status()
+            plan_text = orjson.loads(await response.read())["response"]
+        
+        # Extract tasks from the response
+        tasks = []
+        for line in plan_text.split('\n'):
+            if line.strip() and ('Task' in line or line.strip().startswith(('-', '•', '1.', '2.', '3.', '4.', '5.'))):
+                # Clean up the task text
+                task = TASK_PREFIX_RE.sub('', line.strip())
+                task = NUMBER_PREFIX_RE.sub('', task.strip())
+                task = BULLET_PREFIX_RE.sub('', task.strip())
+                if task:
+                    tasks.append(task)
+        
+        if not tasks:
+            # Raising keeps an unparsable plan out of the cache and triggers the fallback
+            raise ValueError("No research tasks found in the LLM response")
+        return tasks[:5]  # Limit to 5 tasks
+    
+    # Prompts embed search results, so summaries expire with them and are pruned on write
+    @disk_cache("summaries.json", ttl=24 * 3600)
+    async def stream_summary(self, summary_prompt: str) -> AsyncIterator[str]:
+        """Stream the research summary generated from the assembled prompt"""
+        async for token in self.stream_ollama(summary_prompt):
+            yield token
     
     async def execute_research(self, query: str) -> Dict[str, Any]:
         """Execute the full research process"""
+        async for results in self.stream_research(query):
+            pass
+        return results
+    
+    async def stream_research(self, query: str) -> AsyncIterator[Dict[str, Any]]:
+        """Execute the research process, yielding the results each time the summary grows"""
         results = {
             "original_query": query,
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -139,13 +306,13 @@ Keep tasks focused and searchable.
         }
         
         # Step 1: Plan research tasks
-        tasks = self.plan_research_tasks(query)
+        tasks = await self.plan_research_tasks(query)
         results["tasks"] = tasks
         
-        # Step 2: Execute each task
+        # Step 2: Execute all tasks concurrently
+        search_results_list = await asyncio.gather(*(self.web_search(task, num_results=3) for task in tasks))
         all_search_results = []
-        for i, task in enumerate(tasks):
-            search_results = await self.web_search(task, num_results=3)
+        for task, search_results in zip(tasks, search_results_list):
             task_info = {
                 "task": task,
                 "results": search_results
@@ -155,75 +322,74 @@ Keep tasks focused and searchable.
         
         # Step 3: Collect unique references
         unique_refs = {}
-        for result in all_search_results:
-            if result["url"] and result["url"] not in unique_refs:
-                unique_refs[result["url"]] = {
-                    "title": result["title"],
-                    "url": result["url"],
-                    "source": result["source"]
-                }
+        for result in (r for r in all_search_results if r["url"]):
+            unique_refs.setdefault(result["url"], {
+                "title": result["title"],
+                "url": result["url"],
+                "source": result["source"]
+            })
         results["references"] = list(unique_refs.values())
         
         # Step 4: Generate summary
-        summary_prompt = f"""
+        prompt_parts = [f"""
 Based on the following research findings for the query "{query}", write a comprehensive but concise summary:
 
 Research Tasks and Findings:
-"""
+"""]
         for finding in results["findings"]:
-            summary_prompt += f"\nTask: {finding['task']}\n"
+            prompt_parts.append(f"\nTask: {finding['task']}\n")
             for result in finding["results"]:
-                summary_prompt += f"- {result['snippet'][:200]}...\n"
+                prompt_parts.append(f"- {textwrap.shorten(result['snippet'], width=200, placeholder='...')}\n")
         
-        summary_prompt += """
+        prompt_parts.append("""
 Please provide:
 1. A clear, comprehensive summary of the key findings
 2. Important insights or conclusions
 3. Any limitations or areas needing further research
 
 Keep the summary well-structured and informative.
-"""
+""")
+        summary_prompt = "".join(prompt_parts)
         
         try:
-            response = requests.post(f"{self.ollama_host}/api/generate",
-                                   json={"model": self.model, "prompt": summary_prompt, "stream": False},
-                                   timeout=120)
-            
-            if response.status_code == 200:
-                results["summary"] = response.json()["response"]
-            else:
-                results["summary"] = "Summary generation failed."
+            summary_parts = []
+            async for token in self.stream_summary(summary_prompt):
+                summary_parts.append(token)
+                results["summary"] = "".join(summary_parts)
+                yield results
+        except aiohttp.ClientResponseError:
+            results["summary"] = "Summary generation failed."
         except Exception as e:
             results["summary"] = f"Error generating summary: {str(e)}"
         
-        return results
+        yield results
     
     def format_research_brief(self, results: Dict[str, Any]) -> str:
         """Format results into a structured research brief"""
-        brief = f"Research Brief: {results['original_query']}\n"
-        brief += f"Generated: {results['timestamp']}\n\n"
-        
-        brief += "EXECUTIVE SUMMARY\n"
-        brief += f"{results['summary']}\n\n"
-        
-        brief += "RESEARCH TASKS EXECUTED\n"
+        parts = [
+            f"Research Brief: {results['original_query']}\n",
+            f"Generated: {results['timestamp']}\n\n",
+            "EXECUTIVE SUMMARY\n",
+            f"{results['summary']}\n\n",
+            "RESEARCH TASKS EXECUTED\n"
+        ]
         for i, task in enumerate(results['tasks'], 1):
-            brief += f"{i}. {task}\n"
+            parts.append(f"{i}. {task}\n")
         
-        brief += "\nKEY FINDINGS\n"
+        parts.append("\nKEY FINDINGS\n")
         for i, finding in enumerate(results['findings'], 1):
-            brief += f"\nTask {i}: {finding['task']}\n"
+            parts.append(f"\nTask {i}: {finding['task']}\n")
             for result in finding['results']:
                 if result['snippet']:
-                    brief += f"- {result['snippet'][:300]}{'...' if len(result['snippet']) > 300 else ''}\n"
+                    parts.append(f"- {textwrap.shorten(result['snippet'], width=300, placeholder='...')}\n")
         
-        brief += "\nREFERENCES\n"
+        parts.append("\nREFERENCES\n")
         for i, ref in enumerate(results['references'], 1):
-            brief += f"{i}. {ref['title']} - {ref['url']} ({ref['source']})\n"
+            parts.append(f"{i}. {ref['title']} - {ref['url']} ({ref['source']})\n")
         
-        brief += f"\nResearch completed with {len(results['tasks'])} tasks and {len(results['references'])} references"
+        parts.append(f"\nResearch completed with {len(results['tasks'])} tasks and {len(results['references'])} references")
         
-        return brief
+        return "".join(parts)
 
 # Global agent instance - Add your Google API credentials here
 GOOGLE_API_KEY = "Add_your_own_api_key"  # Get from Google Cloud Console
@@ -234,31 +400,24 @@ agent = ResearchAgent(google_api_key=GOOGLE_API_KEY, google_cx=GOOGLE_CX)
 async def research_query(query: str, progress=gr.Progress()):
     """Main research function for Gradio interface"""
     if not query.strip():
-        return "Please enter a research query."
+        yield "Please enter a research query."
+        return
     
     progress(0.1, desc="Planning research tasks...")
     
-    try:
+    async with agent.active():
         # Test Ollama connection
-        test_response = requests.get(f"{agent.ollama_host}/api/tags", timeout=5)
-        if test_response.status_code != 200:
-            return "Error: Cannot connect to Ollama. Please ensure Ollama is running on localhost:11434"
-    except:
-        return "Error: Cannot connect to Ollama. Please ensure Ollama is running on localhost:11434"
-    
-    progress(0.2, desc="Executing research...")
-    
-    
-    results = await agent.execute_research(query)
-    
-    progress(0.9, desc="Formatting results...")
-    
-
-    brief = agent.format_research_brief(results)
+        if not await agent.check_ollama():
+            yield "Error: Cannot connect to Ollama. Please ensure Ollama is running on localhost:11434"
+            return
+        
+        progress(0.2, desc="Executing research...")
+        
+        # Yield the brief so far each time more of the summary arrives
+        async for results in agent.stream_research(query):
+            yield agent.format_research_brief(results)
     
     progress(1.0, desc="Complete!")
-    
-    return brief
 
 def create_interface():
     """Create Gradio interface"""
@@ -279,8 +438,9 @@ def create_interface():
                 update_btn = gr.Button("Update API Keys", size="sm")
         
         def update_api_keys(api_key, cx_id):
-            global agent
-            agent = ResearchAgent(google_api_key=api_key, google_cx=cx_id)
+            # Update in place so the agent keeps its pooled session
+            agent.google_api_key = api_key
+            agent.google_cx = cx_id
             return "API keys updated successfully!"
         
         update_btn.click(
@@ -327,65 +487,12 @@ def create_interface():
     return interface
 
 if __name__ == "__main__":
-    # Check if running in async context
-    import sys
-    
-    def sync_research_query(query: str):
-        """Synchronous wrapper for Gradio"""
-        if not query.strip():
-            return "Please enter a research query."
-        
-        # Run the async function
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            result = loop.run_until_complete(agent.execute_research(query))
-            brief = agent.format_research_brief(result)
-            return brief
-        finally:
-            loop.close()
-    
-    # Update the interface to use sync function
-    with gr.Blocks(title="AI Research Agent", theme=gr.themes.Soft()) as interface:
-        gr.HTML("<h1>🔍 AI Research Agent</h1>")
-        
-        with gr.Row():
-            with gr.Column(scale=2):
-                query_input = gr.Textbox(
-                    label="Research Query",
-                    placeholder="Enter your research question",
-                    lines=2
-                )
-                
-                research_btn = gr.Button("🔍 Start Research", variant="primary", size="lg")
-
-            
-            with gr.Column(scale=3):
-                output = gr.Textbox(
-                    label="Research Brief",
-                    value="Research results will appear here...",
-                    lines=30,
-                    max_lines=50
-                )
-        
-        # Event handlers
-        research_btn.click(
-            fn=sync_research_query,
-            inputs=[query_input],
-            outputs=[output]
-        )
-        
-        query_input.submit(
-            fn=sync_research_query,
-            inputs=[query_input], 
-            outputs=[output]
-        )
-
-    
-    # Launch the interface
+    interface = create_interface()
+    # Let several research runs overlap; they mostly wait on Ollama and search I/O
+    interface.queue(default_concurrency_limit=4)
     interface.launch(
         server_name="0.0.0.0",
         server_port=7860,
         share=False,
         show_error=True
-    )
\ No newline at end of file
+    )